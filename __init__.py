@@ -1,2 +1,8 @@
 """Smart library custom module"""
 from . import models
+
+
+def post_init_hook(env):
+    """Roll up existing circulation and post the ledger of existing fines."""
+    env["circulation.daily.stat"]._rebuild_all_rollups()
+    env["fine.ledger.entry"]._recompute_balances()
@@ -19,11 +19,18 @@
     """,
     "data": [
         "security/ir.model.access.csv",
+        "data/ir_cron.xml",
         "views/books.xml",
         "views/book_items.xml",
         "views/libraries.xml",
         "views/members.xml",
         "views/reservations.xml",
+        "views/stock_takes.xml",
+        "views/recommendations.xml",
+        "views/circulation_stats.xml",
+        "views/circulation_transactions.xml",
+        "views/member_duplicates.xml",
+        "views/fines.xml",
         "views/menu.xml",
     ],
     'assets': {
@@ -36,5 +43,6 @@
         ]
     },
     'application': True,
+    'post_init_hook': 'post_init_hook',
 }
 
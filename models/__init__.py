@@ -1,2 +1,12 @@
 """Models package."""
-from . import base, books, libraries, members
+from . import (
+    base,
+    books,
+    circulation_stats,
+    fine_ledger,
+    libraries,
+    members,
+    offline_circulation,
+    recommendations,
+    stock_take,
+)
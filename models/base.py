@@ -13,13 +13,39 @@ class OwnerlessAbstractBase(models.Model):
     _abstract = True
 
     guid = fields.Char(
-        copy=False, readonly=True, default=lambda self: self._guid()
+        copy=False,
+        readonly=True,
+        index=True,
+        default=lambda self: self._guid(),
     )
     active = fields.Boolean(default=True)
 
-    def guid(self):
+    def init(self):
+        """Give every existing row its own guid.
+
+        When the guid column is added to an existing table, the field
+        default is evaluated once and written to every row, so rows
+        sharing a guid are given a fresh one here.
+        """
+        if not self._auto:
+            return
+
+        self.env.cr.execute(
+            f"""
+            UPDATE "{self._table}"
+            SET guid = md5(random()::text || id::text)::uuid::varchar
+            WHERE guid IS NULL
+               OR guid IN (
+                   SELECT guid FROM "{self._table}"
+                   GROUP BY guid
+                   HAVING count(*) > 1
+               )
+            """
+        )
+
+    def _guid(self):
         """System generated guid."""
-        return uuid.uuid4()
+        return str(uuid.uuid4())
 
 
 class AbstractBase(models.Model):
@@ -30,6 +56,9 @@ class AbstractBase(models.Model):
     _abstract = True
     _inherit = ["ownerless.abstract.base"]
 
+    _history_date_field = "create_date"
+    _history_page_limit = 200
+
     library = fields.Many2one(
         "library",
         ondelete="restrict",
@@ -74,11 +103,114 @@ class AbstractBase(models.Model):
 
         return library
 
-    @api.model
-    def create(self, vals):
-        """Override create method to add a library."""
-        library = self.current_library()
-        if not vals.get("library"):
-            vals["library"] = library.id
+    def _history_action(self, field_name, name):
+        """Window action listing the history rows of a One2many field.
+
+        History tabs are opened on demand instead of being embedded in
+        the form, so opening a record doesn't load its whole history.
+        """
+        self.ensure_one()
+        field = self._fields[field_name]
+        return {
+            "type": "ir.actions.act_window",
+            "name": name,
+            "res_model": field.comodel_name,
+            "view_mode": "tree,form",
+            "domain": [(field.inverse_name, "=", self.id)],
+            "context": {f"default_{field.inverse_name}": self.id},
+        }
+
+    def history_page(
+        self, field_name, before=None, limit=40, field_names=None
+    ):
+        """A page of history rows of a One2many field, most recent first.
+
+        Rows are ordered on the history date of the related model, then
+        id, and pages are keyed on the (date, id) of the last row of the
+        previous page rather than an offset. The cursor date is also an
+        upper bound of its own so every page starts its range scan of the
+        (inverse field, date, id) index at the cursor, however long the
+        history is. Rows without a date are not part of the history.
+
+        :param before: ``[date, id]`` cursor returned with the previous
+            page.
+        :return: a dict with the ``records`` read and the ``next`` cursor,
+            False when there are no more rows.
+        """
+        self.ensure_one()
+        field = self._fields.get(field_name)
+        if not field or field.type != "one2many":
+            raise ValidationError(_("%s is not a history field.", field_name))
+
+        History = self.env[field.comodel_name]
+        date_field = getattr(History, "_history_date_field", "create_date")
+        try:
+            limit = max(1, min(int(limit), self._history_page_limit))
+        except (TypeError, ValueError) as error:
+            raise ValidationError(_("Invalid page size %s.", limit)) from error
+
+        domain = [
+            (field.inverse_name, "=", self.id),
+            (date_field, "!=", False),
+        ]
+        if before:
+            date, record_id = self._history_cursor(History, date_field, before)
+            domain += [
+                (date_field, "<=", date),
+                "|",
+                (date_field, "<", date),
+                "&",
+                (date_field, "=", date),
+                ("id", "<", record_id),
+            ]
+
+        page = History.search(
+            domain, order=f"{date_field} desc, id desc", limit=limit + 1
+        )
+        next_cursor = False
+        if len(page) > limit:
+            last = page[limit - 1]
+            date = History._fields[date_field].to_string(last[date_field])
+            next_cursor = [date, last.id]
+
+        return {
+            "records": page[:limit].read(field_names),
+            "next": next_cursor,
+        }
+
+    def _history_cursor(self, History, date_field, before):
+        """Validate a ``[date, id]`` history cursor."""
+        if not isinstance(before, (list, tuple)) or len(before) != 2:
+            raise ValidationError(_("Invalid history cursor %s.", before))
+
+        date, record_id = before
+        if not isinstance(record_id, int) or isinstance(record_id, bool):
+            raise ValidationError(_("Invalid history cursor %s.", before))
+
+        try:
+            date = History._fields[date_field].convert_to_cache(date, History)
+        except (TypeError, ValueError) as error:
+            raise ValidationError(
+                _("Invalid history cursor %s.", before)
+            ) from error
+
+        if not date:
+            raise ValidationError(_("Invalid history cursor %s.", before))
+
+        return date, record_id
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override create method to add a library.
+
+        The session library is only looked up when some values lack one,
+        so jobs running without an assigned library can still create
+        records for an explicit library.
+        """
+        missing = [vals for vals in vals_list if not vals.get("library")]
+        if missing:
+            library = self.current_library()
+            for vals in missing:
+                vals["library"] = library.id
 
-        return super(AbstractBase, self).create(vals)
+        return super(AbstractBase, self).create(vals_list)
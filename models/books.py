@@ -1,10 +1,13 @@
 """Book business object."""
 import datetime
+import math
 import time
 
 from odoo import api, fields, models
 from odoo.exceptions import UserError, ValidationError
+from odoo.tools import sql
 from .base import AbstractBase
+from .fine_ledger import FineStatus, LedgerEntryType
 
 
 class BookFormat:
@@ -99,6 +102,12 @@ class Book(models.Model):
         ),
     )
     book_items = fields.One2many("book.item", "book", string="Book Items")
+    also_borrowed = fields.One2many(
+        "book.also.borrowed",
+        "book",
+        string="Members Also Borrowed",
+        readonly=True,
+    )
 
     @api.depends("title", "author")
     def name_get(self):
@@ -140,6 +149,7 @@ class BookItem(models.Model):
         copy=False,
         default=lambda self: self._barcode(),
         readonly=True,
+        index=True,
     )
     status = fields.Selection(
         selection=BookStatus.SELECTION, default=BookStatus.AVAILABLE
@@ -159,13 +169,23 @@ class BookItem(models.Model):
     reservations = fields.One2many("book.item.reservation", "book_item")
     fines = fields.One2many("fine", "book_item")
 
+    def init(self):
+        """Index the items of a library by status for stock-takes."""
+        super(BookItem, self).init()
+        sql.create_index(
+            self.env.cr,
+            "book_item_library_status_idx",
+            self._table,
+            ["library", "status"],
+        )
+
     def _barcode(self):
         """System generated barcode."""
         timestamp = str(time.time())[-6:]
         return f"BAR-{timestamp}"
 
-    def _due_date(self):
-        """Calculate the due date of a book item."""
+    def _due_date(self, borrowed_date=None):
+        """Calculate the due date of a book item borrowed on a date."""
         library = AbstractBase.current_library(self)
         library_borrowing_settings = library.borrowing_settings[0]
         if not library_borrowing_settings:
@@ -174,7 +194,7 @@ class BookItem(models.Model):
             )
 
         duration = library_borrowing_settings.duration
-        borrowed_date = datetime.datetime.now()
+        borrowed_date = borrowed_date or datetime.datetime.now()
         due_date = None
         if library_borrowing_settings.duration_type == "Days":
             due_date = borrowed_date + datetime.timedelta(days=duration)
@@ -204,18 +224,20 @@ class BookItem(models.Model):
     @api.constrains("status", "borrowed_by")
     def validate_borrowed_by_status(self):
         """Ensure borrowed_by is supplied when borrowing a book."""
-        if self.status == BookStatus.BORROWED and not self.borrowed_by:
-            raise ValidationError(
-                "Provide a member before borrowing a book item."
-            )
+        for record in self:
+            if record.status == BookStatus.BORROWED and not record.borrowed_by:
+                raise ValidationError(
+                    "Provide a member before borrowing a book item."
+                )
 
     @api.constrains("status", "reserved_by")
     def validate_reserved_by_status(self):
         """Ensure reserved_by is supplied when reserving a book."""
-        if self.status == BookStatus.RESERVED and not self.reserved_by:
-            raise ValidationError(
-                "Provide a member before reserving a book item."
-            )
+        for record in self:
+            if record.status == BookStatus.RESERVED and not record.reserved_by:
+                raise ValidationError(
+                    "Provide a member before reserving a book item."
+                )
 
     def update_borrowed_fields(self, record):
         """Update borrowed fields metadata."""
@@ -231,6 +253,8 @@ class BookItem(models.Model):
                 "This book item has already been borrowed by this member."
             )
 
+        record.borrowed_by._check_fine_block()
+
         record.status = BookStatus.BORROWED
         record.reserved_by = False
         borrowed_date = datetime.datetime.now()
@@ -241,7 +265,10 @@ class BookItem(models.Model):
             "borrowed_date": borrowed_date,
             "due_date": due_date,
         }
-        self.env["issued.book.item"].create(issued_book_payload)
+        issued_book = self.env["issued.book.item"].create(issued_book_payload)
+        self.env["circulation.daily.stat"]._record_event(
+            issued_book.library, record.book, borrowed_date, loans=1
+        )
 
     def action_borrow_book(self):
         """Action to borrow a book."""
@@ -297,6 +324,13 @@ class BookItem(models.Model):
             record.status = BookStatus.AVAILABLE
 
             due_date = issued_book_item.due_date
+            self.env["circulation.daily.stat"]._record_event(
+                issued_book_item.library,
+                record.book,
+                returned_date,
+                returns=1,
+                overdue_returns=int(returned_date > due_date),
+            )
             if returned_date > due_date:
                 fine_payload = {
                     "member": record.borrowed_by.id,
@@ -310,6 +344,18 @@ class BookItem(models.Model):
 
         return True
 
+    def action_view_issued_to(self):
+        """Open the loan history of the book item."""
+        return self._history_action("issued_to", "Issued To")
+
+    def action_view_fines(self):
+        """Open the fines of the book item."""
+        return self._history_action("fines", "Fines")
+
+    def action_view_reservations(self):
+        """Open the reservations of the book item."""
+        return self._history_action("reservations", "Reservations")
+
     def action_report_lost_book(self):
         """Report a book item as lost."""
         for record in self:
@@ -336,6 +382,7 @@ class IssuedBookItem(models.Model):
     _name = "issued.book.item"
     _description = "Book item(s) issued to a library member"
     _inherit = "abstract.base"
+    _history_date_field = "borrowed_date"
 
     member = fields.Many2one(
         "member", required=True, ondelete="restrict", readonly=True
@@ -347,6 +394,7 @@ class IssuedBookItem(models.Model):
         help="The borrowed date of the issued book item.",
         copy=False,
         readonly=True,
+        index=True,
     )
     due_date = fields.Datetime(
         help="The return date of the issued book item.",
@@ -356,8 +404,38 @@ class IssuedBookItem(models.Model):
     returned_date = fields.Datetime(
         help="The actual return date of the issued book item.",
         copy=False,
+        index=True,
+    )
+    co_borrow_counted = fields.Boolean(
+        copy=False,
+        readonly=True,
+        default=False,
+        help="Whether the loan is counted in the co-borrowing statistics.",
     )
 
+    def init(self):
+        """Index the most recent first history of items and members."""
+        super(IssuedBookItem, self).init()
+        sql.create_index(
+            self.env.cr,
+            "issued_book_item_book_item_history_idx",
+            self._table,
+            ["book_item", "borrowed_date DESC", "id DESC"],
+        )
+        sql.create_index(
+            self.env.cr,
+            "issued_book_item_member_history_idx",
+            self._table,
+            ["member", "borrowed_date DESC", "id DESC"],
+        )
+        sql.create_index(
+            self.env.cr,
+            "issued_book_item_co_borrow_pending_idx",
+            self._table,
+            ["id"],
+            where="co_borrow_counted IS NOT TRUE",
+        )
+
     @api.depends("book_item")
     def name_get(self):
         """Display name of book item model."""
@@ -389,6 +467,7 @@ class BookItemReservation(models.Model):
     _name = "book.item.reservation"
     _description = "A reservation made on a book item."
     _inherit = "abstract.base"
+    _history_date_field = "reserved_on"
 
     book_item = fields.Many2one(
         "book.item", required=True, ondelete="restrict"
@@ -440,6 +519,16 @@ class BookItemReservation(models.Model):
                     "You can not reserve a book you have already borrowed. Return it first."
                 )
 
+    def init(self):
+        """Index the most recent first reservations of an item."""
+        super(BookItemReservation, self).init()
+        sql.create_index(
+            self.env.cr,
+            "book_item_reservation_book_item_history_idx",
+            self._table,
+            ["book_item", "reserved_on DESC", "id DESC"],
+        )
+
     @api.depends("book_item")
     def name_get(self):
         """Display name of book item reservation model."""
@@ -463,13 +552,24 @@ class Fine(models.Model):
     _name = "fine"
     _description = "Fine applied to a particular late book item."
     _inherit = "abstract.base"
+    _history_date_field = "returned_date"
 
-    member = fields.Many2one("member", required=True, ondelete="restrict")
+    member = fields.Many2one(
+        "member", required=True, ondelete="restrict", index=True
+    )
     book_item = fields.Many2one(
         "book.item", required=True, ondelete="restrict"
     )
-    amount = fields.Float(
-        copy=False, default=lambda self: self._compute_fine()
+    amount = fields.Float(copy=False)
+    amount_due = fields.Float(
+        copy=False,
+        readonly=True,
+        help="What is left to pay, maintained by the fine ledger.",
+    )
+    status = fields.Selection(
+        selection=FineStatus.SELECTION,
+        default=FineStatus.OUTSTANDING,
+        readonly=True,
     )
     due_date = fields.Datetime(
         help="The return date of the issued book item.",
@@ -478,29 +578,104 @@ class Fine(models.Model):
     returned_date = fields.Datetime(
         help="The actual return date of the issued book item.",
         copy=False,
+        index=True,
     )
+    ledger_entries = fields.One2many("fine.ledger.entry", "fine")
+
+    def init(self):
+        """Index the most recent first fines of an item."""
+        super(Fine, self).init()
+        sql.create_index(
+            self.env.cr,
+            "fine_book_item_history_idx",
+            self._table,
+            ["book_item", "returned_date DESC", "id DESC"],
+        )
 
-    def _compute_fine(self):
+    @api.depends("book_item", "amount")
+    def name_get(self):
+        """Display name of fine model."""
+        display = []
+        for record in self:
+            name = f"{record.book_item.barcode} : {record.amount}"
+            display.append((record.id, name))
+        return display
+
+    def _compute_fine(self, due_date, returned_date):
         """Compute fines acquired."""
         library = AbstractBase.current_library(self)
-        library_fine_settings = library.fine_settings[0]
+        library_fine_settings = library.fine_settings[:1]
         if not library_fine_settings:
             raise UserError("Session library has no active fines settings.")
 
-        delta = None
+        late = returned_date - due_date
+        late_days = math.ceil(late.total_seconds() / 86400)
+        periods = None
         if library_fine_settings.duration_type == "Days":
-            delta = self.returned_date - self.due_date
+            periods = late_days
 
         elif library_fine_settings.duration_type == "Weeks":
-            delta = self.returned_date - self.due_date
+            periods = math.ceil(late_days / 7)
 
         elif library_fine_settings.duration_type == "Months":
-            delta = self.returned_date - self.due_date
+            periods = math.ceil(late_days / 30)
 
         elif library_fine_settings.duration_type == "Years":
-            delta = self.returned_date - self.due_date
+            periods = math.ceil(late_days / 365)
 
         else:
             raise UserError("Calendar band not implemented.")
 
-        return delta * library_fine_settings.amount
+        return max(periods, 0) * library_fine_settings.amount
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override create method to charge the fines to the ledger."""
+        for vals in vals_list:
+            if not vals.get("amount") and vals.get("due_date"):
+                vals["amount"] = self._compute_fine(
+                    fields.Datetime.to_datetime(vals["due_date"]),
+                    fields.Datetime.to_datetime(
+                        vals.get("returned_date") or fields.Datetime.now()
+                    ),
+                )
+
+        fines = super(Fine, self).create(vals_list)
+        self.env["fine.ledger.entry"].with_context(
+            fine_ledger_charge=True
+        ).create(
+            [
+                {
+                    "fine": fine.id,
+                    "member": fine.member.id,
+                    "entry_type": LedgerEntryType.CHARGE,
+                    "amount": fine.amount,
+                }
+                for fine in fines
+            ]
+        )
+        for fine in fines:
+            self.env["circulation.daily.stat"]._record_event(
+                fine.library,
+                fine.book_item.book,
+                fine.returned_date or fields.Datetime.now(),
+                fines=1,
+                fine_amount=fine.amount,
+            )
+        return fines
+
+    def action_waive(self):
+        """Waive what is left to pay on the fines."""
+        self.env["fine.ledger.entry"].create(
+            [
+                {
+                    "fine": record.id,
+                    "member": record.member.id,
+                    "entry_type": LedgerEntryType.WAIVER,
+                    "amount": record.amount_due,
+                }
+                for record in self
+                if record.amount_due > 0
+            ]
+        )
+        return True
@@ -0,0 +1,222 @@
+"""Circulation statistics reporting objects."""
+from odoo import api, fields, models
+from .books import BookFormat
+from .libraries import LibraryType
+
+
+class CirculationDailyStat(models.Model):
+    """Circulation activity of a library rolled up per day and format."""
+
+    _name = "circulation.daily.stat"
+    _description = "Daily rollup of loans, returns and fines of a library."
+    _order = "day desc, library, format"
+
+    day = fields.Date(required=True, readonly=True)
+    library = fields.Many2one(
+        "library", required=True, ondelete="cascade", readonly=True
+    )
+    library_type = fields.Selection(
+        selection=LibraryType.SELECTION, string="Type", readonly=True
+    )
+    format = fields.Selection(
+        selection=BookFormat.SELECTION, required=True, readonly=True
+    )
+    loans = fields.Integer(readonly=True)
+    returns = fields.Integer(readonly=True)
+    overdue_returns = fields.Integer(readonly=True)
+    fines = fields.Integer(readonly=True)
+    fine_amount = fields.Float(
+        string="Fines Charged",
+        readonly=True,
+        help="Amount charged by the fines, before payments and waivers.",
+    )
+
+    _sql_constraints = [
+        (
+            "day_library_format_unique",
+            "UNIQUE(day, library, format)",
+            "There is only one rollup per library, day and format.",
+        ),
+    ]
+
+    @api.model
+    def _record_event(
+        self,
+        library,
+        book,
+        day,
+        loans=0,
+        returns=0,
+        overdue_returns=0,
+        fines=0,
+        fine_amount=0.0,
+    ):
+        """Add a circulation event to the rollup of its day.
+
+        The counters are incremented in the database so concurrent
+        circulation desks never overwrite each other's updates.
+        """
+        self.env.cr.execute(
+            """
+            INSERT INTO circulation_daily_stat
+                (day, library, library_type, format, loans, returns,
+                 overdue_returns, fines, fine_amount,
+                 create_uid, create_date, write_uid, write_date)
+            VALUES (%(day)s, %(library)s, %(library_type)s, %(format)s,
+                    %(loans)s, %(returns)s, %(overdue_returns)s, %(fines)s,
+                    %(fine_amount)s, %(uid)s, now() at time zone 'UTC',
+                    %(uid)s, now() at time zone 'UTC')
+            ON CONFLICT (day, library, format) DO UPDATE
+            SET loans = circulation_daily_stat.loans + EXCLUDED.loans,
+                returns = circulation_daily_stat.returns + EXCLUDED.returns,
+                overdue_returns = circulation_daily_stat.overdue_returns
+                    + EXCLUDED.overdue_returns,
+                fines = circulation_daily_stat.fines + EXCLUDED.fines,
+                fine_amount = circulation_daily_stat.fine_amount
+                    + EXCLUDED.fine_amount,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+            """,
+            {
+                "day": fields.Date.to_date(day),
+                "library": library.id,
+                "library_type": library.library_type,
+                "format": book.format or BookFormat.HARD_COVER,
+                "loans": loans,
+                "returns": returns,
+                "overdue_returns": overdue_returns,
+                "fines": fines,
+                "fine_amount": fine_amount or 0.0,
+                "uid": self.env.uid,
+            },
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild_rollups(self, date_from, date_to):
+        """Recompute the rollups of a date range from the source records.
+
+        Loans, returns and fines are read through their date indexes and
+        aggregated in a single grouped query.
+        """
+        for model in ("issued.book.item", "fine", "book.item", "book"):
+            self.env[model].flush_model()
+
+        date_from = fields.Date.to_date(date_from)
+        date_to = fields.Date.to_date(date_to)
+        self.env.cr.execute(
+            "DELETE FROM circulation_daily_stat WHERE day BETWEEN %s AND %s",
+            (date_from, date_to),
+        )
+        self.env.cr.execute(
+            """
+            INSERT INTO circulation_daily_stat
+                (day, library, library_type, format, loans, returns,
+                 overdue_returns, fines, fine_amount,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT events.day, events.library, library.library_type,
+                   coalesce(book.format, %(default_format)s),
+                   sum(events.loans), sum(events.returns),
+                   sum(events.overdue_returns), sum(events.fines),
+                   sum(events.fine_amount),
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM (
+                SELECT borrowed_date::date AS day, library, book_item,
+                       1 AS loans, 0 AS returns, 0 AS overdue_returns,
+                       0 AS fines, 0.0 AS fine_amount
+                FROM issued_book_item
+                WHERE borrowed_date >= %(date_from)s
+                  AND borrowed_date < %(date_to)s::date + 1
+                UNION ALL
+                SELECT returned_date::date, library, book_item,
+                       0, 1, (returned_date > due_date)::integer, 0, 0.0
+                FROM issued_book_item
+                WHERE returned_date >= %(date_from)s
+                  AND returned_date < %(date_to)s::date + 1
+                UNION ALL
+                SELECT returned_date::date, library, book_item,
+                       0, 0, 0, 1, coalesce(amount, 0.0)
+                FROM fine
+                WHERE returned_date >= %(date_from)s
+                  AND returned_date < %(date_to)s::date + 1
+            ) AS events
+            JOIN library ON library.id = events.library
+            JOIN book_item AS item ON item.id = events.book_item
+            JOIN book ON book.id = item.book
+            GROUP BY events.day, events.library, library.library_type,
+                     coalesce(book.format, %(default_format)s)
+            """,
+            {
+                "date_from": date_from,
+                "date_to": date_to,
+                "default_format": BookFormat.HARD_COVER,
+                "uid": self.env.uid,
+            },
+        )
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def _rebuild_all_rollups(self):
+        """Recompute the rollups of the whole circulation history.
+
+        Runs once when the module is installed. Databases upgrading from
+        a version without rollups should call it once as well, e.g. from
+        an Odoo shell, since upgrades do not run the install hook.
+        """
+        self.env["issued.book.item"].flush_model(["borrowed_date"])
+        self.env["fine"].flush_model(["returned_date"])
+        self.env.cr.execute(
+            """
+            SELECT min(day) FROM (
+                SELECT min(borrowed_date)::date AS day FROM issued_book_item
+                UNION ALL
+                SELECT min(returned_date)::date FROM fine
+            ) AS first_events
+            """
+        )
+        date_from = self.env.cr.fetchone()[0]
+        if not date_from:
+            return True
+
+        return self._rebuild_rollups(
+            date_from, fields.Date.context_today(self)
+        )
+
+    @api.model
+    def _cron_refresh_rollups(self, days=2):
+        """Nightly job reconciling the most recent rollups."""
+        today = fields.Date.context_today(self)
+        return self._rebuild_rollups(
+            fields.Date.subtract(today, days=days), today
+        )
+
+    @api.model
+    def circulation_statistics(self, date_from, date_to, groupby=None):
+        """Aggregated circulation figures read from the daily rollups.
+
+        :param groupby: rollup fields to group on, e.g. ``["day:year"]``
+            for year-over-year dashboards or ``["format"]``.
+        :return: a list of dicts with the summed counters and the overdue
+            rate of every group.
+        """
+        groups = self.read_group(
+            [("day", ">=", date_from), ("day", "<=", date_to)],
+            [
+                "loans:sum",
+                "returns:sum",
+                "overdue_returns:sum",
+                "fines:sum",
+                "fine_amount:sum",
+            ],
+            groupby or ["day:month"],
+            lazy=False,
+        )
+        for group in groups:
+            returns = group.get("returns") or 0
+            group["overdue_rate"] = (
+                group.get("overdue_returns", 0) / returns if returns else 0.0
+            )
+
+        return groups
@@ -0,0 +1,292 @@
+"""Fine ledger business objects."""
+from collections import defaultdict
+
+from odoo import api, fields, models
+from odoo.exceptions import ValidationError
+
+
+class FineStatus:
+    """Class to store the various statuses of a fine."""
+
+    OUTSTANDING = "Outstanding"
+    SETTLED = "Settled"
+
+    OPTIONS = [OUTSTANDING, SETTLED]
+    SELECTION = [
+        ("Outstanding", OUTSTANDING),
+        ("Settled", SETTLED),
+    ]
+
+
+class LedgerEntryType:
+    """Class to store the various types of fine ledger entries."""
+
+    CHARGE = "Charge"
+    PAYMENT = "Payment"
+    WAIVER = "Waiver"
+
+    OPTIONS = [CHARGE, PAYMENT, WAIVER]
+    SELECTION = [
+        ("Charge", CHARGE),
+        ("Payment", PAYMENT),
+        ("Waiver", WAIVER),
+    ]
+
+
+class FineLedgerEntry(models.Model):
+    """A charge, payment or waiver on a fine."""
+
+    _name = "fine.ledger.entry"
+    _description = "A movement on the fines owed by a library member."
+    _inherit = "abstract.base"
+    _order = "date desc, id desc"
+
+    fine = fields.Many2one(
+        "fine", required=True, ondelete="restrict", index=True
+    )
+    member = fields.Many2one(
+        "member", required=True, ondelete="restrict", index=True
+    )
+    entry_type = fields.Selection(
+        selection=LedgerEntryType.SELECTION,
+        string="Type",
+        required=True,
+        default=LedgerEntryType.PAYMENT,
+    )
+    amount = fields.Float(
+        required=True, help="The amount charged, paid or waived."
+    )
+    date = fields.Datetime(default=lambda self: fields.Datetime.now())
+    note = fields.Char()
+
+    _sql_constraints = [
+        (
+            "amount_positive",
+            "CHECK(amount >= 0)",
+            "A ledger entry amount can not be negative.",
+        ),
+    ]
+
+    _immutable_fields = {"fine", "entry_type", "amount", "date"}
+
+    @api.depends("entry_type", "amount")
+    def name_get(self):
+        """Display name of fine ledger entry model."""
+        display = []
+        for record in self:
+            name = f"{record.entry_type} : {record.amount}"
+            display.append((record.id, name))
+        return display
+
+    def _balance_change(self):
+        """Signed effect of the entry on what the member owes."""
+        if self.entry_type == LedgerEntryType.CHARGE:
+            return self.amount
+        return -self.amount
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        """Override create method to keep the balances up to date.
+
+        Charges are only posted by fines themselves; desks can record
+        payments and waivers.
+        """
+        posting_charges = self.env.context.get("fine_ledger_charge")
+        for vals in vals_list:
+            charge = vals.get("entry_type") == LedgerEntryType.CHARGE
+            if charge and not posting_charges:
+                raise ValidationError(
+                    "Charges are posted automatically when a fine is created."
+                )
+
+            if vals.get("fine") and not vals.get("member"):
+                fine = self.env["fine"].browse(vals["fine"])
+                vals["member"] = fine.member.id
+
+        entries = super(FineLedgerEntry, self).create(vals_list)
+        entries._validate_settlements()
+        entries._apply_to_balances()
+        return entries
+
+    def write(self, vals):
+        """Ledger entries are never rewritten, only offset."""
+        if self._immutable_fields.intersection(vals):
+            raise ValidationError(
+                "Ledger entries can not be changed. "
+                "Record a payment or waiver instead."
+            )
+
+        return super(FineLedgerEntry, self).write(vals)
+
+    def unlink(self):
+        """Ledger entries are never deleted, only offset."""
+        raise ValidationError(
+            "Ledger entries can not be deleted. "
+            "Record a payment or waiver instead."
+        )
+
+    def _validate_settlements(self):
+        """Payments and waivers can not exceed what is left on a fine.
+
+        The fines are locked first so concurrent payments on the same fine
+        are serialised instead of both reading the same amount due.
+        """
+        settled = defaultdict(float)
+        for record in self:
+            if record.entry_type != LedgerEntryType.CHARGE:
+                settled[record.fine] += record.amount
+
+        if not settled:
+            return
+
+        fines = self.env["fine"].union(*settled)
+        self.env["fine"].flush_model(["amount_due"])
+        self.env.cr.execute(
+            "SELECT id FROM fine WHERE id IN %s FOR UPDATE",
+            (tuple(fines.ids),),
+        )
+        fines.invalidate_recordset(["amount_due"])
+
+        for fine, amount in settled.items():
+            if amount > fine.amount_due + 0.005:
+                raise ValidationError(
+                    f"Only {fine.amount_due} is left to pay on this fine."
+                )
+
+    def _apply_to_balances(self):
+        """Add the entries to the stored fine and member balances.
+
+        The balances are incremented in the database, one statement per
+        table, so concurrent desks never overwrite each other's updates.
+        """
+        member_changes = defaultdict(float)
+        fine_changes = defaultdict(float)
+        for record in self:
+            member_changes[record.member.id] += record._balance_change()
+            fine_changes[record.fine.id] += record._balance_change()
+
+        self.env["member"].flush_model(["fine_balance"])
+        self.env["fine"].flush_model(["amount_due", "status"])
+        self.env.cr.execute(
+            """
+            UPDATE member
+            SET fine_balance = coalesce(member.fine_balance, 0)
+                + change.amount
+            FROM unnest(%s::integer[], %s::float8[]) AS change(id, amount)
+            WHERE member.id = change.id
+            """,
+            (list(member_changes), list(member_changes.values())),
+        )
+        self.env.cr.execute(
+            """
+            UPDATE fine
+            SET amount_due = coalesce(fine.amount_due, 0) + change.amount,
+                status = CASE
+                    WHEN coalesce(fine.amount_due, 0) + change.amount > 0.005
+                        THEN %s
+                    ELSE %s
+                END
+            FROM unnest(%s::integer[], %s::float8[]) AS change(id, amount)
+            WHERE fine.id = change.id
+            """,
+            (
+                FineStatus.OUTSTANDING,
+                FineStatus.SETTLED,
+                list(fine_changes),
+                list(fine_changes.values()),
+            ),
+        )
+        self.env["member"].invalidate_model(["fine_balance"])
+        self.env["fine"].invalidate_model(["amount_due", "status"])
+
+    @api.model
+    def _recompute_balances(self, members=None):
+        """Rebuild the stored balances from the ledger.
+
+        Fines that predate the ledger get their charge entry first. The
+        fine and member balances are then recomputed from grouped sums
+        and only rows that drifted are rewritten.
+        """
+        self.flush_model()
+        self.env["fine"].flush_model()
+        self.env.cr.execute(
+            """
+            INSERT INTO fine_ledger_entry
+                (guid, active, library, fine, member, entry_type, amount,
+                 date, create_uid, create_date, write_uid, write_date)
+            SELECT md5(random()::text || fine.id::text)::uuid::varchar,
+                   true, fine.library, fine.id, fine.member, %(charge)s,
+                   coalesce(fine.amount, 0),
+                   coalesce(fine.returned_date, fine.create_date),
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM fine
+            WHERE NOT EXISTS (
+                SELECT 1 FROM fine_ledger_entry AS entry
+                WHERE entry.fine = fine.id AND entry.entry_type = %(charge)s
+            )
+            """,
+            {"charge": LedgerEntryType.CHARGE, "uid": self.env.uid},
+        )
+        member_ids = members.ids if members is not None else None
+        self.env.cr.execute(
+            """
+            WITH balances AS (
+                SELECT fine.id, fine.member,
+                       coalesce(sum(CASE
+                           WHEN entry.entry_type = %(charge)s
+                               THEN entry.amount
+                           ELSE -entry.amount
+                       END), 0) AS amount
+                FROM fine
+                LEFT JOIN fine_ledger_entry AS entry ON entry.fine = fine.id
+                WHERE %(members)s::integer[] IS NULL
+                   OR fine.member = ANY(%(members)s::integer[])
+                GROUP BY fine.id, fine.member
+            )
+            UPDATE fine
+            SET amount_due = balances.amount,
+                status = CASE
+                    WHEN balances.amount > 0.005 THEN %(outstanding)s
+                    ELSE %(settled)s
+                END
+            FROM balances
+            WHERE fine.id = balances.id
+              AND (fine.amount_due IS DISTINCT FROM balances.amount
+                   OR fine.status IS NULL)
+            """,
+            {
+                "charge": LedgerEntryType.CHARGE,
+                "members": member_ids,
+                "outstanding": FineStatus.OUTSTANDING,
+                "settled": FineStatus.SETTLED,
+            },
+        )
+        self.env.cr.execute(
+            """
+            WITH balances AS (
+                SELECT member.id,
+                       coalesce(sum(CASE
+                           WHEN entry.entry_type = %(charge)s
+                               THEN entry.amount
+                           ELSE -entry.amount
+                       END), 0) AS amount
+                FROM member
+                LEFT JOIN fine_ledger_entry AS entry
+                    ON entry.member = member.id
+                WHERE %(members)s::integer[] IS NULL
+                   OR member.id = ANY(%(members)s::integer[])
+                GROUP BY member.id
+            )
+            UPDATE member
+            SET fine_balance = balances.amount
+            FROM balances
+            WHERE member.id = balances.id
+              AND member.fine_balance IS DISTINCT FROM balances.amount
+            """,
+            {"charge": LedgerEntryType.CHARGE, "members": member_ids},
+        )
+        self.invalidate_model()
+        self.env["member"].invalidate_model(["fine_balance"])
+        self.env["fine"].invalidate_model(["amount_due", "status"])
+        return True
@@ -130,6 +130,10 @@ class FineSettings(models.Model):
         help="Calender bands for duration.",
     )
     amount = fields.Float(required=True, copy=False)
+    block_threshold = fields.Float(
+        copy=False,
+        help="Members owing more than this can not borrow. 0 disables it.",
+    )
 
     @api.constrains("library")
     def validate_only_one_setting(self):
@@ -1,5 +1,8 @@
 """Library member business objects."""
+import re
+
 from odoo import api, fields, models
+from odoo.exceptions import ValidationError
 
 
 class Member(models.Model):
@@ -9,7 +12,7 @@ class Member(models.Model):
     _description = "A member of a library."
     _inherit = "abstract.base"
 
-    name = fields.Char(required=True, copy=False)
+    name = fields.Char(required=True, copy=False, index="trigram")
     registered_on = fields.Datetime(default=lambda self: fields.Datetime.now())
     removed_on = fields.Datetime()
     phone_number = fields.Char(
@@ -21,9 +24,77 @@ class Member(models.Model):
         help="The primary email address of the member",
         copy=False,
     )
+    phone_key = fields.Char(
+        compute="_compute_lookup_keys",
+        store=True,
+        index=True,
+        help="The phone number reduced to its last significant digits.",
+    )
+    email_key = fields.Char(
+        compute="_compute_lookup_keys",
+        store=True,
+        index=True,
+        help="The email address trimmed and lower cased.",
+    )
     issued_book_items = fields.One2many(
         "issued.book.item", "member", string="Issued Book Items"
     )
+    fine_balance = fields.Float(
+        readonly=True,
+        copy=False,
+        help="What the member owes, maintained by the fine ledger.",
+    )
+
+    _phone_key_digits = 9
+
+    @api.model
+    def _normalize_phone(self, phone_number):
+        """Reduce a phone number to the digits that identify it.
+
+        Only the trailing digits are kept so the same number typed with
+        or without a country code or trunk prefix gets the same key.
+        """
+        digits = re.sub(r"\D", "", phone_number or "")
+        return digits[-self._phone_key_digits :] or False
+
+    @api.model
+    def _normalize_email(self, email):
+        """Trim and lower case an email address."""
+        return (email or "").strip().lower() or False
+
+    @api.depends("phone_number", "email")
+    def _compute_lookup_keys(self):
+        """Compute the normalised phone and email lookup keys."""
+        for record in self:
+            record.phone_key = self._normalize_phone(record.phone_number)
+            record.email_key = self._normalize_email(record.email)
+
+    @api.model
+    def _name_search(
+        self, name, domain=None, operator="ilike", limit=None, order=None
+    ):
+        """Find members by phone or email key, or by name otherwise.
+
+        A query that looks like a phone number or an email address is
+        matched exactly on the indexed lookup keys; any other query falls
+        back to the trigram indexed name search.
+        """
+        if name and operator in ("ilike", "=", "=ilike"):
+            if "@" in name:
+                key_domain = [("email_key", "=", self._normalize_email(name))]
+            elif re.fullmatch(r"[\d\s()+.-]{6,}", name):
+                key_domain = [("phone_key", "=", self._normalize_phone(name))]
+            else:
+                key_domain = None
+
+            if key_domain:
+                return self._search(
+                    (domain or []) + key_domain, limit=limit, order=order
+                )
+
+        return super(Member, self)._name_search(
+            name, domain=domain, operator=operator, limit=limit, order=order
+        )
 
     @api.depends("name")
     def name_get(self):
@@ -32,3 +103,203 @@ class Member(models.Model):
         for record in self:
             display.append((record.id, record.name))
         return display
+
+    def action_view_issued_book_items(self):
+        """Open the loan history of the member."""
+        return self._history_action("issued_book_items", "Issued Book Items")
+
+    def _fine_block_threshold(self):
+        """Fine balance above which the member can't borrow, if any."""
+        self.ensure_one()
+        return self.library.fine_settings[:1].block_threshold
+
+    def _is_fine_blocked(self):
+        """Whether the member owes more than the library threshold."""
+        self.ensure_one()
+        threshold = self._fine_block_threshold()
+        return bool(threshold) and self.fine_balance > threshold
+
+    def _check_fine_block(self):
+        """Members owing more than the library threshold can't borrow."""
+        for record in self:
+            if record._is_fine_blocked():
+                raise ValidationError(
+                    f"{record.name} owes {record.fine_balance} in fines, "
+                    "above the borrowing limit of "
+                    f"{record._fine_block_threshold()}."
+                )
+
+
+class DuplicateStatus:
+    """Class to store the various statuses of a duplicate group."""
+
+    PENDING = "Pending"
+    MERGED = "Merged"
+    DISMISSED = "Dismissed"
+
+    OPTIONS = [PENDING, MERGED, DISMISSED]
+    SELECTION = [
+        ("Pending", PENDING),
+        ("Merged", MERGED),
+        ("Dismissed", DISMISSED),
+    ]
+
+
+class MemberDuplicateGroup(models.Model):
+    """Members of a library that probably are the same person."""
+
+    _name = "member.duplicate.group"
+    _description = "A cluster of probable duplicate library members."
+    _inherit = "abstract.base"
+    _order = "id desc"
+
+    master = fields.Many2one(
+        "member",
+        ondelete="cascade",
+        help="The member kept when the group is merged.",
+    )
+    members = fields.Many2many("member", string="Members", readonly=True)
+    match_keys = fields.Char(
+        readonly=True, help="The phone and email keys the members share."
+    )
+    status = fields.Selection(
+        selection=DuplicateStatus.SELECTION,
+        default=DuplicateStatus.PENDING,
+        help="Status of a duplicate group.",
+    )
+
+    @api.depends("master")
+    def name_get(self):
+        """Display name of member duplicate group model."""
+        display = []
+        for record in self:
+            name = f"Duplicates of {record.master.name}"
+            display.append((record.id, name))
+        return display
+
+    @api.model
+    def _find_duplicates(self):
+        """Cluster probable duplicate members of every library.
+
+        Members are only compared within blocks sharing a phone or email
+        key, read from the key indexes in one grouped query. Blocks that
+        share a member are then joined into a single cluster.
+        """
+        self.env["member"].flush_model(["phone_key", "email_key", "library"])
+        self.env.cr.execute(
+            """
+            SELECT library, 'phone:' || phone_key, array_agg(id ORDER BY id)
+            FROM member
+            WHERE active AND phone_key IS NOT NULL
+            GROUP BY library, phone_key
+            HAVING count(*) > 1
+            UNION ALL
+            SELECT library, 'email:' || email_key, array_agg(id ORDER BY id)
+            FROM member
+            WHERE active AND email_key IS NOT NULL
+            GROUP BY library, email_key
+            HAVING count(*) > 1
+            """
+        )
+        parents = {}
+
+        def find(member_id):
+            while parents.setdefault(member_id, member_id) != member_id:
+                parents[member_id] = parents[parents[member_id]]
+                member_id = parents[member_id]
+            return member_id
+
+        libraries = {}
+        block_keys = []
+        for library, key, member_ids in self.env.cr.fetchall():
+            for member_id in member_ids:
+                parents[find(member_id)] = find(member_ids[0])
+                libraries[member_id] = library
+            block_keys.append((member_ids[0], key))
+
+        clusters = {}
+        for member_id in list(parents):
+            clusters.setdefault(find(member_id), []).append(member_id)
+
+        keys = {}
+        for member_id, key in block_keys:
+            keys.setdefault(find(member_id), []).append(key)
+
+        self.search([("status", "=", DuplicateStatus.PENDING)]).unlink()
+        dismissed = {
+            frozenset(group.members.ids)
+            for group in self.search(
+                [("status", "=", DuplicateStatus.DISMISSED)]
+            )
+        }
+        payloads = []
+        for root, member_ids in clusters.items():
+            if frozenset(member_ids) in dismissed:
+                continue
+
+            payloads.append(
+                {
+                    "library": libraries[root],
+                    "master": min(member_ids),
+                    "members": [fields.Command.set(member_ids)],
+                    "match_keys": ", ".join(sorted(keys.get(root, []))),
+                }
+            )
+
+        return self.create(payloads)
+
+    def _member_references(self):
+        """Stored many2one fields pointing to a member."""
+        return self.env["ir.model.fields"].sudo().search(
+            [
+                ("relation", "=", "member"),
+                ("ttype", "=", "many2one"),
+                ("store", "=", True),
+            ]
+        )
+
+    def action_merge(self):
+        """Move the loans, fines and other records onto the master member.
+
+        Every reference to the duplicates is rewritten with one write per
+        referencing field, then the duplicates are archived.
+        """
+        references = self._member_references()
+        for record in self:
+            if record.status != DuplicateStatus.PENDING:
+                raise ValidationError("Only pending duplicates can be merged.")
+
+            master = record.master or record.members.sorted("id")[:1]
+            duplicates = record.members - master
+            for reference in references:
+                Model = self.env[reference.model].with_context(
+                    active_test=False
+                )
+                if Model._abstract or not Model._auto:
+                    continue
+
+                Model.search([(reference.name, "in", duplicates.ids)]).write(
+                    {reference.name: master.id}
+                )
+
+            if not master.email:
+                emails = duplicates.filtered("email").mapped("email")
+                if emails:
+                    master.email = emails[0]
+
+            self.env["fine.ledger.entry"]._recompute_balances(record.members)
+            duplicates.write(
+                {"active": False, "removed_on": fields.Datetime.now()}
+            )
+            record.write(
+                {"master": master.id, "status": DuplicateStatus.MERGED}
+            )
+
+        return True
+
+    def action_dismiss(self):
+        """Mark the members of the group as distinct people."""
+        for record in self:
+            record.status = DuplicateStatus.DISMISSED
+
+        return True
@@ -0,0 +1,428 @@
+"""Offline circulation business objects."""
+import datetime
+from collections import defaultdict
+
+from odoo import api, fields, models
+from odoo.exceptions import ValidationError
+from .books import BookStatus, ReservationStatus
+
+
+class CirculationAction:
+    """Class to store the circulation actions recorded offline."""
+
+    BORROW = "Borrow"
+    RETURN = "Return"
+
+    OPTIONS = [BORROW, RETURN]
+    SELECTION = [
+        ("Borrow", BORROW),
+        ("Return", RETURN),
+    ]
+
+
+class TransactionStatus:
+    """Class to store the outcomes of replaying an offline transaction."""
+
+    APPLIED = "Applied"
+    CONFLICT = "Conflict"
+
+    OPTIONS = [APPLIED, CONFLICT]
+    SELECTION = [
+        ("Applied", APPLIED),
+        ("Conflict", CONFLICT),
+    ]
+
+
+class CirculationTransaction(models.Model):
+    """A borrow or return recorded by a branch laptop while offline.
+
+    Laptops queue transactions as dicts of the form::
+
+        {
+            "guid": "4c1f0e9e-...",
+            "barcode": "BAR-123456",
+            "member": 42,
+            "action": "Borrow",
+            "timestamp": "2024-03-01 10:15:00",
+        }
+
+    where ``guid`` is generated on the laptop in the same format as
+    ``ownerless.abstract.base`` guids and ``timestamp`` is in UTC.
+    """
+
+    _name = "circulation.transaction"
+    _description = "A circulation transaction synced from an offline desk."
+    _inherit = "abstract.base"
+    _order = "timestamp desc, id desc"
+
+    barcode = fields.Char(readonly=True)
+    book_item = fields.Many2one(
+        "book.item", ondelete="restrict", readonly=True
+    )
+    member = fields.Many2one("member", ondelete="restrict", readonly=True)
+    action = fields.Selection(
+        selection=CirculationAction.SELECTION, readonly=True
+    )
+    timestamp = fields.Datetime(
+        readonly=True,
+        help="When the transaction happened at the desk.",
+    )
+    synced_on = fields.Datetime(
+        default=lambda self: fields.Datetime.now(), readonly=True
+    )
+    status = fields.Selection(
+        selection=TransactionStatus.SELECTION,
+        readonly=True,
+        help="Outcome of replaying the transaction.",
+    )
+    message = fields.Char(readonly=True, help="Reason of a conflict.")
+
+    _sql_constraints = [
+        (
+            "guid_unique",
+            "UNIQUE(guid)",
+            "An offline transaction can only be synced once.",
+        ),
+    ]
+
+    @api.depends("barcode", "action")
+    def name_get(self):
+        """Display name of circulation transaction model."""
+        display = []
+        for record in self:
+            display.append((record.id, f"{record.action} {record.barcode}"))
+        return display
+
+    def _parse_transaction(self, transaction):
+        """Validate the shape of an offline transaction."""
+        if not isinstance(transaction, dict):
+            raise ValidationError("Offline transaction is not an object.")
+
+        missing = [
+            key
+            for key in ("guid", "barcode", "member", "action", "timestamp")
+            if not transaction.get(key)
+        ]
+        if missing:
+            raise ValidationError(
+                f"Offline transaction is missing {', '.join(missing)}."
+            )
+
+        if not isinstance(transaction["guid"], str):
+            raise ValidationError(f"Invalid guid {transaction['guid']}.")
+
+        if transaction["action"] not in CirculationAction.OPTIONS:
+            raise ValidationError(
+                f"Unknown circulation action {transaction['action']}."
+            )
+
+        try:
+            member = int(transaction["member"])
+        except (TypeError, ValueError) as error:
+            raise ValidationError(
+                f"Invalid member {transaction['member']}."
+            ) from error
+
+        try:
+            timestamp = fields.Datetime.to_datetime(transaction["timestamp"])
+        except (TypeError, ValueError) as error:
+            raise ValidationError(
+                f"Invalid timestamp {transaction['timestamp']}."
+            ) from error
+
+        return {
+            "guid": transaction["guid"],
+            "barcode": transaction["barcode"],
+            "member": member,
+            "action": transaction["action"],
+            "timestamp": timestamp,
+        }
+
+    def _rejected_transaction(self, transaction, error):
+        """Entry for a malformed transaction, replayed as a conflict."""
+        transaction = transaction if isinstance(transaction, dict) else {}
+        barcode = transaction.get("barcode")
+        action = transaction.get("action")
+        return {
+            "guid": transaction.get("guid"),
+            "barcode": barcode if isinstance(barcode, str) else False,
+            "member": False,
+            "action": action if action in CirculationAction.OPTIONS else False,
+            "timestamp": False,
+            "error": error.args[0],
+        }
+
+    @api.model
+    def sync_transactions(self, transactions):
+        """Replay a batch of offline transactions in timestamp order.
+
+        Transactions whose guid was already synced are skipped, so a
+        laptop can safely resend a batch after a dropped connection.
+        Items, members, open loans and reservations are fetched once for
+        the whole batch, the transactions are replayed against that
+        snapshot, and the resulting loans, returns, fines and item
+        statuses are written in bulk.
+
+        Malformed transactions are reported as conflicts, and logged when
+        they carry a guid, without aborting the rest of the batch. A guid
+        repeated within the batch is only replayed once, the repeats are
+        reported as duplicates.
+
+        :return: a dict with the ``applied`` guids, the ``conflicts`` as
+            ``{"guid", "message"}`` dicts and the ``duplicates`` already
+            synced before or repeated in the batch, with their status.
+        """
+        entries = []
+        rejected = []
+        for transaction in transactions:
+            try:
+                entries.append(self._parse_transaction(transaction))
+            except ValidationError as error:
+                entry = self._rejected_transaction(transaction, error)
+                if isinstance(entry["guid"], str) and entry["guid"]:
+                    entries.append(entry)
+                else:
+                    rejected.append(
+                        {
+                            "guid": entry["guid"] or False,
+                            "message": entry["error"],
+                        }
+                    )
+
+        guids = [entry["guid"] for entry in entries]
+        synced = {
+            record.guid: record
+            for record in self.search([("guid", "in", guids)])
+        }
+        duplicates = [
+            {
+                "guid": guid,
+                "status": synced[guid].status,
+                "message": synced[guid].message or "",
+            }
+            for guid in dict.fromkeys(guids)
+            if guid in synced
+        ]
+        seen = set(synced)
+        pending = []
+        repeated = []
+        for entry in entries:
+            if entry["guid"] not in seen:
+                seen.add(entry["guid"])
+                pending.append(entry)
+            elif entry["guid"] not in synced:
+                repeated.append(entry["guid"])
+
+        pending.sort(
+            key=lambda entry: (
+                entry["timestamp"] or datetime.datetime.min,
+                entry["guid"],
+            )
+        )
+        result = self._replay(pending)
+        outcomes = {
+            guid: (TransactionStatus.APPLIED, "") for guid in result["applied"]
+        }
+        for conflict in result["conflicts"]:
+            outcomes[conflict["guid"]] = (
+                TransactionStatus.CONFLICT,
+                conflict["message"],
+            )
+
+        for guid in repeated:
+            status, message = outcomes[guid]
+            duplicates.append(
+                {"guid": guid, "status": status, "message": message}
+            )
+
+        result["conflicts"] = rejected + result["conflicts"]
+        result["duplicates"] = duplicates
+        return result
+
+    def _replay(self, entries):
+        """Apply new offline transactions with set-based writes."""
+        BookItem = self.env["book.item"]
+        items = defaultdict(lambda: BookItem)
+        barcodes = [entry["barcode"] for entry in entries if entry["barcode"]]
+        for item in BookItem.search([("barcode", "in", barcodes)]):
+            items[item.barcode] |= item
+
+        member_ids = {entry["member"] for entry in entries if entry["member"]}
+        members = {
+            member.id: member
+            for member in self.env["member"].browse(member_ids).exists()
+        }
+        all_items = BookItem.union(*items.values())
+        state = {
+            item.id: (item.status, item.borrowed_by.id) for item in all_items
+        }
+        open_loans = {
+            loan.book_item.id: loan
+            for loan in self.env["issued.book.item"].search(
+                [
+                    ("book_item", "in", all_items.ids),
+                    ("returned_date", "=", False),
+                ],
+                order="borrowed_date",
+            )
+        }
+        reservations = {
+            (reservation.book_item.id, reservation.member.id): reservation
+            for reservation in self.env["book.item.reservation"].search(
+                [
+                    ("book_item", "in", all_items.ids),
+                    ("status", "=", ReservationStatus.WAITING),
+                ]
+            )
+        }
+
+        new_loans = []
+        opened = {}
+        returns = {}
+        completed = self.env["book.item.reservation"]
+        fines = []
+        log = []
+        applied = []
+        conflicts = []
+        for entry in entries:
+            item = items.get(entry["barcode"], BookItem)
+            member = members.get(entry["member"], self.env["member"])
+            message = None
+            if entry.get("error"):
+                message = entry["error"]
+            elif not item:
+                message = "Unknown book item barcode."
+            elif len(item) > 1:
+                message = "The barcode matches more than one book item."
+            elif not member:
+                message = "Unknown member."
+            elif (
+                entry["action"] == CirculationAction.BORROW
+                and member._is_fine_blocked()
+            ):
+                message = "The member owes fines above the borrowing limit."
+            elif entry["action"] == CirculationAction.BORROW:
+                status = state[item.id][0]
+                reservation = reservations.get((item.id, member.id))
+                if status == BookStatus.RESERVED and not reservation:
+                    message = (
+                        "The member does not have a waiting reservation "
+                        "to this book item."
+                    )
+                elif status == BookStatus.BORROWED:
+                    message = (
+                        "The book has already been borrowed by another "
+                        "member."
+                    )
+                elif status == BookStatus.LOST:
+                    message = "The book is lost to the library."
+                else:
+                    if reservation:
+                        completed |= reservation
+                        reservations.pop((item.id, member.id))
+
+                    loan = {
+                        "member": member.id,
+                        "book_item": item.id,
+                        "borrowed_date": entry["timestamp"],
+                        "due_date": item._due_date(entry["timestamp"]),
+                    }
+                    new_loans.append(loan)
+                    opened[item.id] = loan
+                    state[item.id] = (BookStatus.BORROWED, member.id)
+            else:
+                status, borrower = state[item.id]
+                if status != BookStatus.BORROWED:
+                    message = "You can only return a borrowed book."
+                elif borrower != member.id:
+                    message = "The book item is borrowed by another member."
+                elif item.id not in opened and item.id not in open_loans:
+                    message = "The book item has no open loan."
+                else:
+                    if item.id in opened:
+                        loan = opened.pop(item.id)
+                        loan["returned_date"] = entry["timestamp"]
+                        due_date = loan["due_date"]
+                    else:
+                        loan = open_loans.pop(item.id)
+                        returns[loan] = entry["timestamp"]
+                        due_date = loan.due_date
+
+                    if entry["timestamp"] > due_date:
+                        fines.append(
+                            {
+                                "member": member.id,
+                                "book_item": item.id,
+                                "due_date": due_date,
+                                "returned_date": entry["timestamp"],
+                            }
+                        )
+                    state[item.id] = (BookStatus.AVAILABLE, False)
+
+            if message:
+                status = TransactionStatus.CONFLICT
+                conflicts.append({"guid": entry["guid"], "message": message})
+            else:
+                status = TransactionStatus.APPLIED
+                applied.append(entry["guid"])
+
+            log.append(
+                {
+                    "guid": entry["guid"],
+                    "barcode": entry["barcode"],
+                    "book_item": item.id if len(item) == 1 else False,
+                    "member": member.id,
+                    "action": entry["action"],
+                    "timestamp": entry["timestamp"],
+                    "status": status,
+                    "message": message,
+                }
+            )
+
+        self._apply(all_items, state, new_loans, returns, completed, fines)
+        self.create(log)
+        return {"applied": applied, "conflicts": conflicts}
+
+    def _apply(self, items, state, new_loans, returns, completed, fines):
+        """Write the replayed circulation state in bulk."""
+        Stats = self.env["circulation.daily.stat"]
+        loans = self.env["issued.book.item"].create(new_loans)
+        for loan in loans:
+            Stats._record_event(
+                loan.library, loan.book_item.book, loan.borrowed_date, loans=1
+            )
+            if loan.returned_date:
+                Stats._record_event(
+                    loan.library,
+                    loan.book_item.book,
+                    loan.returned_date,
+                    returns=1,
+                    overdue_returns=int(loan.returned_date > loan.due_date),
+                )
+
+        for loan, returned_date in returns.items():
+            loan.returned_date = returned_date
+            Stats._record_event(
+                loan.library,
+                loan.book_item.book,
+                returned_date,
+                returns=1,
+                overdue_returns=int(returned_date > loan.due_date),
+            )
+
+        changes = defaultdict(lambda: self.env["book.item"])
+        for item in items:
+            if state[item.id] != (item.status, item.borrowed_by.id):
+                changes[state[item.id]] |= item
+
+        for (status, borrower), changed in changes.items():
+            payload = {"status": status, "borrowed_by": borrower}
+            if status == BookStatus.BORROWED:
+                payload["reserved_by"] = False
+            changed.write(payload)
+
+        completed.write({"status": ReservationStatus.COMPLETED})
+        completed.book_item.filtered("reserved_by").write(
+            {"reserved_by": False}
+        )
+        self.env["fine"].create(fines)
@@ -0,0 +1,295 @@
+"""Book recommendation objects precomputed from loan history."""
+from odoo import api, fields, models
+from odoo.tools import sql
+
+
+class PopularityPeriod:
+    """Rolling windows, in days, over which loans are counted."""
+
+    WEEK = "7"
+    MONTH = "30"
+    QUARTER = "90"
+    YEAR = "365"
+
+    OPTIONS = [WEEK, MONTH, QUARTER, YEAR]
+    SELECTION = [
+        ("7", "Last 7 Days"),
+        ("30", "Last 30 Days"),
+        ("90", "Last 90 Days"),
+        ("365", "Last 365 Days"),
+    ]
+
+
+class BookPopularity(models.Model):
+    """Most borrowed books of a library over a rolling window."""
+
+    _name = "book.popularity"
+    _description = "Top borrowed books of a library over a rolling window."
+    _order = "library, period, rank"
+
+    _top_k = 20
+
+    library = fields.Many2one("library", ondelete="cascade", readonly=True)
+    period = fields.Selection(
+        selection=PopularityPeriod.SELECTION, required=True, readonly=True
+    )
+    rank = fields.Integer(required=True, readonly=True)
+    book = fields.Many2one(
+        "book", required=True, ondelete="cascade", readonly=True
+    )
+    loan_count = fields.Integer(readonly=True)
+
+    def init(self):
+        """Index the (library, period, rank) read path of the catalog."""
+        sql.create_index(
+            self.env.cr,
+            "book_popularity_library_period_rank_idx",
+            self._table,
+            ["library", "period", "rank"],
+        )
+
+    @api.model
+    def _refresh_popularity(self):
+        """Recount loans per book over every rolling window.
+
+        Windows slide every day so the whole table is rebuilt, but only
+        loans of the last year are read, through the borrowed date index,
+        and counted in a single grouped query.
+        """
+        self.env["issued.book.item"].flush_model(["book_item", "borrowed_date"])
+        self.env.cr.execute("DELETE FROM book_popularity")
+        self.env.cr.execute(
+            """
+            INSERT INTO book_popularity
+                (library, period, rank, book, loan_count,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT library, period, rank, book, loan_count,
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM (
+                SELECT book.library, periods.period, item.book,
+                       count(*) AS loan_count,
+                       row_number() OVER (
+                           PARTITION BY book.library, periods.period
+                           ORDER BY count(*) DESC, item.book
+                       ) AS rank
+                FROM issued_book_item AS issued
+                JOIN book_item AS item ON item.id = issued.book_item
+                JOIN book ON book.id = item.book
+                JOIN unnest(%(periods)s::varchar[]) AS periods(period)
+                    ON issued.borrowed_date >= now() at time zone 'UTC'
+                        - periods.period::integer * interval '1 day'
+                WHERE issued.borrowed_date >= now() at time zone 'UTC'
+                    - %(longest)s * interval '1 day'
+                GROUP BY book.library, periods.period, item.book
+            ) AS ranked
+            WHERE rank <= %(top_k)s
+            """,
+            {
+                "uid": self.env.uid,
+                "periods": PopularityPeriod.OPTIONS,
+                "longest": max(int(days) for days in PopularityPeriod.OPTIONS),
+                "top_k": self._top_k,
+            },
+        )
+        self.invalidate_model()
+        return True
+
+    @api.model
+    def popular_books(self, library, period=PopularityPeriod.MONTH, limit=10):
+        """Most borrowed books of a library, for the catalog and kiosk."""
+        return self.search(
+            [("library", "=", library.id), ("period", "=", period)],
+            order="rank",
+            limit=limit,
+        ).book
+
+
+class BookCoBorrowCount(models.Model):
+    """Number of members who borrowed both books of a pair."""
+
+    _name = "book.co.borrow.count"
+    _description = "Members who borrowed both books of a pair."
+
+    book = fields.Many2one(
+        "book", required=True, ondelete="cascade", readonly=True
+    )
+    related_book = fields.Many2one(
+        "book", required=True, ondelete="cascade", readonly=True
+    )
+    member_count = fields.Integer(readonly=True)
+
+    _sql_constraints = [
+        (
+            "book_related_book_unique",
+            "UNIQUE(book, related_book)",
+            "A pair of books is only counted once.",
+        ),
+    ]
+
+
+class BookAlsoBorrowed(models.Model):
+    """Books most often borrowed by members who borrowed a book."""
+
+    _name = "book.also.borrowed"
+    _description = "Top books also borrowed by the borrowers of a book."
+    _order = "book, rank"
+
+    _top_k = 10
+
+    book = fields.Many2one(
+        "book", required=True, ondelete="cascade", readonly=True
+    )
+    rank = fields.Integer(required=True, readonly=True)
+    related_book = fields.Many2one(
+        "book", required=True, ondelete="cascade", readonly=True
+    )
+    member_count = fields.Integer(readonly=True)
+
+    def init(self):
+        """Index the (book, rank) read path of the catalog."""
+        sql.create_index(
+            self.env.cr,
+            "book_also_borrowed_book_rank_idx",
+            self._table,
+            ["book", "rank"],
+        )
+
+    @api.model
+    def _refresh_also_borrowed(self):
+        """Fold the loans not counted yet into the pair counts.
+
+        A member contributes once to a pair of books. Only the books a
+        member borrowed for the first time in the uncounted loans can
+        create new pairs, so they are paired with the member's counted
+        books and with each other, counted in a single grouped upsert.
+        The top-K lists are then rebuilt only for the books whose counts
+        changed.
+
+        Loans are flagged once counted rather than compared to a high
+        water mark, because loan ids are allocated before their
+        transaction commits and may become visible out of order.
+        """
+        self.env["issued.book.item"].flush_model(
+            ["member", "book_item", "co_borrow_counted"]
+        )
+        self.env.cr.execute(
+            """
+            SELECT id FROM issued_book_item
+            WHERE co_borrow_counted IS NOT TRUE
+            FOR UPDATE SKIP LOCKED
+            """
+        )
+        loan_ids = [row[0] for row in self.env.cr.fetchall()]
+        if not loan_ids:
+            return True
+
+        self.env.cr.execute(
+            """
+            WITH new_loans AS (
+                SELECT DISTINCT issued.member, item.book
+                FROM issued_book_item AS issued
+                JOIN book_item AS item ON item.id = issued.book_item
+                WHERE issued.id = ANY(%(loans)s)
+            ),
+            old_loans AS (
+                SELECT DISTINCT issued.member, item.book
+                FROM issued_book_item AS issued
+                JOIN book_item AS item ON item.id = issued.book_item
+                WHERE issued.co_borrow_counted
+                  AND issued.member IN (SELECT member FROM new_loans)
+            ),
+            fresh AS (
+                SELECT member, book FROM new_loans
+                EXCEPT
+                SELECT member, book FROM old_loans
+            ),
+            pairs AS (
+                SELECT fresh.book, old_loans.book AS related_book
+                FROM fresh
+                JOIN old_loans ON old_loans.member = fresh.member
+                UNION ALL
+                SELECT old_loans.book, fresh.book
+                FROM fresh
+                JOIN old_loans ON old_loans.member = fresh.member
+                UNION ALL
+                SELECT fresh.book, other.book
+                FROM fresh
+                JOIN fresh AS other
+                    ON other.member = fresh.member AND other.book != fresh.book
+            )
+            INSERT INTO book_co_borrow_count
+                (book, related_book, member_count,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT book, related_book, count(*),
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM pairs
+            GROUP BY book, related_book
+            ON CONFLICT (book, related_book) DO UPDATE
+            SET member_count = book_co_borrow_count.member_count
+                    + EXCLUDED.member_count,
+                write_uid = EXCLUDED.write_uid,
+                write_date = EXCLUDED.write_date
+            RETURNING book
+            """,
+            {"uid": self.env.uid, "loans": loan_ids},
+        )
+        books = list({row[0] for row in self.env.cr.fetchall()})
+        if books:
+            self._rebuild_top_k(books)
+
+        self.env.cr.execute(
+            """
+            UPDATE issued_book_item
+            SET co_borrow_counted = true
+            WHERE id = ANY(%s)
+            """,
+            (loan_ids,),
+        )
+        self.env["issued.book.item"].invalidate_model(["co_borrow_counted"])
+        self.env["book.co.borrow.count"].invalidate_model()
+        return True
+
+    def _rebuild_top_k(self, books):
+        """Rebuild the top-K lists of the given book ids."""
+        self.env.cr.execute(
+            "DELETE FROM book_also_borrowed WHERE book = ANY(%s)", (books,)
+        )
+        self.env.cr.execute(
+            """
+            INSERT INTO book_also_borrowed
+                (book, rank, related_book, member_count,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT book, rank, related_book, member_count,
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM (
+                SELECT book, related_book, member_count,
+                       row_number() OVER (
+                           PARTITION BY book
+                           ORDER BY member_count DESC, related_book
+                       ) AS rank
+                FROM book_co_borrow_count
+                WHERE book = ANY(%(books)s)
+            ) AS ranked
+            WHERE rank <= %(top_k)s
+            """,
+            {"uid": self.env.uid, "books": books, "top_k": self._top_k},
+        )
+        self.invalidate_model()
+
+    @api.model
+    def _rebuild_also_borrowed(self):
+        """Recount every pair from the whole loan history."""
+        self.env.cr.execute("DELETE FROM book_co_borrow_count")
+        self.env.cr.execute("DELETE FROM book_also_borrowed")
+        self.env.cr.execute(
+            """
+            UPDATE issued_book_item
+            SET co_borrow_counted = false
+            WHERE co_borrow_counted
+            """
+        )
+        self.env["issued.book.item"].invalidate_model(["co_borrow_counted"])
+        return self._refresh_also_borrowed()
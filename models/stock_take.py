@@ -0,0 +1,445 @@
+"""Inventory stock-take business objects."""
+import base64
+
+from odoo import api, fields, models
+from odoo.exceptions import UserError, ValidationError
+from .books import BookStatus, ReservationStatus
+
+
+class StockTakeStatus:
+    """Class to store the various statuses of a stock-take session."""
+
+    DRAFT = "Draft"
+    SCANNING = "Scanning"
+    RECONCILED = "Reconciled"
+    DONE = "Done"
+
+    OPTIONS = [DRAFT, SCANNING, RECONCILED, DONE]
+    SELECTION = [
+        ("Draft", DRAFT),
+        ("Scanning", SCANNING),
+        ("Reconciled", RECONCILED),
+        ("Done", DONE),
+    ]
+
+
+class StockTakeResult:
+    """Class to store the outcomes of reconciling a scanned barcode."""
+
+    MISSING = "Missing"
+    MISPLACED = "Misplaced"
+    UNEXPECTED = "Unexpected"
+    FOUND = "Found"
+    AMBIGUOUS = "Ambiguous"
+
+    OPTIONS = [MISSING, MISPLACED, UNEXPECTED, FOUND, AMBIGUOUS]
+    SELECTION = [
+        ("Missing", MISSING),
+        ("Misplaced", MISPLACED),
+        ("Unexpected", UNEXPECTED),
+        ("Found", FOUND),
+        ("Ambiguous", AMBIGUOUS),
+    ]
+
+
+class StockTake(models.Model):
+    """A shelf reconciliation session for a library."""
+
+    _name = "stock.take"
+    _description = "A stock-take comparing scanned barcodes to book items."
+    _inherit = "abstract.base"
+
+    name = fields.Char(required=True, copy=False)
+    started_on = fields.Datetime(default=lambda self: fields.Datetime.now())
+    reconciled_on = fields.Datetime(readonly=True, copy=False)
+    status = fields.Selection(
+        selection=StockTakeStatus.SELECTION,
+        default=StockTakeStatus.DRAFT,
+        help="Status of a stock-take session.",
+    )
+    scan_file = fields.Binary(
+        string="Scan File",
+        attachment=False,
+        copy=False,
+        help="A text or CSV export with one scanned barcode per line.",
+    )
+    scan_filename = fields.Char(copy=False)
+    scan_input = fields.Char(
+        string="Scan",
+        copy=False,
+        help="A single barcode typed or scanned at the shelf.",
+    )
+    scans = fields.One2many("stock.take.scan", "stock_take", readonly=True)
+    lines = fields.One2many("stock.take.line", "stock_take", readonly=True)
+    scan_count = fields.Integer(compute="_compute_counts")
+    missing_count = fields.Integer(compute="_compute_counts")
+    misplaced_count = fields.Integer(compute="_compute_counts")
+    unexpected_count = fields.Integer(compute="_compute_counts")
+    found_count = fields.Integer(compute="_compute_counts")
+    ambiguous_count = fields.Integer(compute="_compute_counts")
+
+    @api.depends("name")
+    def name_get(self):
+        """Display name of stock-take model."""
+        display = []
+        for record in self:
+            display.append((record.id, record.name))
+        return display
+
+    @api.depends("scans", "lines")
+    def _compute_counts(self):
+        """Count scans and reconciliation results per session."""
+        scan_counts = dict(
+            self.env["stock.take.scan"]._read_group(
+                [("stock_take", "in", self.ids)],
+                ["stock_take"],
+                ["__count"],
+            )
+        )
+        result_counts = {
+            (stock_take, result): count
+            for stock_take, result, count in self.env[
+                "stock.take.line"
+            ]._read_group(
+                [("stock_take", "in", self.ids)],
+                ["stock_take", "result"],
+                ["__count"],
+            )
+        }
+        for record in self:
+            record.scan_count = scan_counts.get(record, 0)
+            record.missing_count = result_counts.get(
+                (record, StockTakeResult.MISSING), 0
+            )
+            record.misplaced_count = result_counts.get(
+                (record, StockTakeResult.MISPLACED), 0
+            )
+            record.unexpected_count = result_counts.get(
+                (record, StockTakeResult.UNEXPECTED), 0
+            )
+            record.found_count = result_counts.get(
+                (record, StockTakeResult.FOUND), 0
+            )
+            record.ambiguous_count = result_counts.get(
+                (record, StockTakeResult.AMBIGUOUS), 0
+            )
+
+    def _ensure_open(self):
+        """Only sessions that are not closed accept changes."""
+        for record in self:
+            if record.status == StockTakeStatus.DONE:
+                raise ValidationError("This stock-take has been closed.")
+
+    def add_scans(self, barcodes):
+        """Append a batch of scanned barcodes to the session.
+
+        Scanners and uploads can send thousands of barcodes at once, so
+        they are inserted with a single statement instead of one ORM
+        create per barcode. Scanning after a reconcile discards its
+        discrepancies, so the session has to be reconciled again.
+        """
+        self.ensure_one()
+        self._ensure_open()
+        barcodes = [barcode.strip() for barcode in barcodes if barcode]
+        barcodes = [barcode for barcode in barcodes if barcode]
+        if not barcodes:
+            return 0
+
+        self.env["stock.take.scan"].flush_model()
+        self.env.cr.execute(
+            """
+            INSERT INTO stock_take_scan
+                (stock_take, barcode, scanned_on,
+                 create_uid, create_date, write_uid, write_date)
+            SELECT %(stock_take)s, barcode, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC',
+                   %(uid)s, now() at time zone 'UTC'
+            FROM unnest(%(barcodes)s::varchar[]) AS barcode
+            """,
+            {"stock_take": self.id, "uid": self.env.uid, "barcodes": barcodes},
+        )
+        self.env["stock.take.scan"].invalidate_model()
+        self.invalidate_recordset(["scans"])
+        if self.status == StockTakeStatus.RECONCILED:
+            self.lines.unlink()
+            self.write(
+                {"status": StockTakeStatus.SCANNING, "reconciled_on": False}
+            )
+        elif self.status == StockTakeStatus.DRAFT:
+            self.status = StockTakeStatus.SCANNING
+
+        return len(barcodes)
+
+    def action_add_scan(self):
+        """Record the barcode in the scan input and clear it."""
+        for record in self:
+            if not record.scan_input:
+                raise ValidationError("Scan or type a barcode first.")
+
+            record.add_scans([record.scan_input])
+            record.scan_input = False
+
+        return True
+
+    def action_import_scans(self):
+        """Import the uploaded scan file, one barcode per line."""
+        for record in self:
+            if not record.scan_file:
+                raise UserError("Upload a scan file first.")
+
+            try:
+                content = base64.b64decode(record.scan_file).decode("utf-8-sig")
+            except (ValueError, UnicodeDecodeError) as error:
+                raise UserError("The scan file is not a text file.") from error
+
+            barcodes = [
+                line.split(",")[0].strip('"') for line in content.splitlines()
+            ]
+            record.add_scans(barcodes)
+            record.write({"scan_file": False, "scan_filename": False})
+
+        return True
+
+    def action_reconcile(self):
+        """Diff the scanned barcodes against the library's book items.
+
+        The comparison is done with set operations in the database:
+        - Missing: items expected on the shelf that were not scanned.
+        - Misplaced: scanned items that belong to another library.
+        - Found: scanned items that were reported lost.
+        - Unexpected: unknown barcodes, or items that are out on loan.
+        - Ambiguous: barcodes matching several items of this library, or
+          several items of other libraries and none of this one.
+
+        A scanned barcode that also matches an item of another library is
+        attributed to the local item.
+        """
+        self._ensure_open()
+        self.env["stock.take.scan"].flush_model()
+        self.env["book.item"].flush_model(["barcode", "library", "status"])
+        for record in self:
+            self.env.cr.execute(
+                "DELETE FROM stock_take_line WHERE stock_take = %s",
+                (record.id,),
+            )
+            self.env.cr.execute(
+                """
+                WITH scanned AS (
+                    SELECT DISTINCT barcode
+                    FROM stock_take_scan
+                    WHERE stock_take = %(stock_take)s
+                ),
+                expected AS (
+                    SELECT id, barcode
+                    FROM book_item
+                    WHERE library = %(library)s
+                      AND active
+                      AND status IN %(on_shelf)s
+                ),
+                candidates AS (
+                    SELECT scanned.barcode, item.id AS item_id,
+                           item.library, item.status,
+                           bool_or(item.library = %(library)s) OVER (
+                               PARTITION BY scanned.barcode
+                           ) AS has_local
+                    FROM scanned
+                    LEFT JOIN book_item AS item
+                        ON item.barcode = scanned.barcode
+                ),
+                preferred AS (
+                    SELECT barcode, item_id, library, status,
+                           count(item_id) OVER (
+                               PARTITION BY barcode
+                           ) AS matches
+                    FROM candidates
+                    WHERE NOT coalesce(has_local, false)
+                       OR library = %(library)s
+                )
+                INSERT INTO stock_take_line
+                    (stock_take, book_item, barcode, result, resolved,
+                     create_uid, create_date, write_uid, write_date)
+                SELECT %(stock_take)s, item_id, barcode, result, false,
+                       %(uid)s, now() at time zone 'UTC',
+                       %(uid)s, now() at time zone 'UTC'
+                FROM (
+                    SELECT expected.id AS item_id, expected.barcode,
+                           %(missing)s AS result
+                    FROM expected
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM scanned
+                        WHERE scanned.barcode = expected.barcode
+                    )
+                    UNION ALL
+                    SELECT NULL, barcode, %(ambiguous)s
+                    FROM preferred
+                    WHERE matches > 1
+                    GROUP BY barcode
+                    UNION ALL
+                    SELECT item_id, barcode,
+                           CASE
+                               WHEN item_id IS NULL THEN %(unexpected)s
+                               WHEN library != %(library)s
+                                   THEN %(misplaced)s
+                               WHEN status = %(lost)s THEN %(found)s
+                               ELSE %(unexpected)s
+                           END
+                    FROM preferred
+                    WHERE matches <= 1
+                      AND (item_id IS NULL
+                           OR library != %(library)s
+                           OR status NOT IN %(on_shelf)s)
+                ) AS diff
+                """,
+                {
+                    "stock_take": record.id,
+                    "library": record.library.id,
+                    "uid": self.env.uid,
+                    "on_shelf": (BookStatus.AVAILABLE, BookStatus.RESERVED),
+                    "lost": BookStatus.LOST,
+                    "missing": StockTakeResult.MISSING,
+                    "misplaced": StockTakeResult.MISPLACED,
+                    "unexpected": StockTakeResult.UNEXPECTED,
+                    "found": StockTakeResult.FOUND,
+                    "ambiguous": StockTakeResult.AMBIGUOUS,
+                },
+            )
+            record.write(
+                {
+                    "status": StockTakeStatus.RECONCILED,
+                    "reconciled_on": fields.Datetime.now(),
+                }
+            )
+
+        self.env["stock.take.line"].invalidate_model()
+        self.invalidate_recordset(["lines"])
+        return True
+
+    def _resolve_items(self, result, current_statuses, status):
+        """Set the status of every unresolved item with the given result.
+
+        Items are only updated while their current status is still one of
+        ``current_statuses``: an item that circulated since the reconcile
+        is left alone and its line stays unresolved.
+
+        :return: ids of the book items that were updated.
+        """
+        for record in self:
+            if record.status != StockTakeStatus.RECONCILED:
+                raise ValidationError(
+                    "Reconcile the stock-take before updating book items."
+                )
+
+        self.env["stock.take.line"].flush_model()
+        self.env["book.item"].flush_model(["status", "reserved_by"])
+        self.env.cr.execute(
+            """
+            WITH updated AS (
+                UPDATE book_item
+                SET status = %(status)s,
+                    reserved_by = CASE
+                        WHEN %(status)s = %(lost)s THEN NULL
+                        ELSE reserved_by
+                    END,
+                    write_uid = %(uid)s,
+                    write_date = now() at time zone 'UTC'
+                WHERE id IN (
+                    SELECT book_item
+                    FROM stock_take_line
+                    WHERE stock_take IN %(stock_takes)s
+                      AND result = %(result)s
+                      AND NOT resolved
+                      AND book_item IS NOT NULL
+                )
+                  AND status IN %(current_statuses)s
+                RETURNING id
+            )
+            UPDATE stock_take_line
+            SET resolved = true,
+                write_uid = %(uid)s,
+                write_date = now() at time zone 'UTC'
+            WHERE stock_take IN %(stock_takes)s
+              AND result = %(result)s
+              AND NOT resolved
+              AND book_item IN (SELECT id FROM updated)
+            RETURNING book_item
+            """,
+            {
+                "uid": self.env.uid,
+                "stock_takes": tuple(self.ids),
+                "result": result,
+                "current_statuses": tuple(current_statuses),
+                "status": status,
+                "lost": BookStatus.LOST,
+            },
+        )
+        item_ids = list({row[0] for row in self.env.cr.fetchall()})
+        self.env["stock.take.line"].invalidate_model(["resolved"])
+        self.env["book.item"].invalidate_model(["status", "reserved_by"])
+        return item_ids
+
+    def action_mark_missing_lost(self):
+        """Report every missing item of the session as lost in one step."""
+        item_ids = self._resolve_items(
+            StockTakeResult.MISSING,
+            [BookStatus.AVAILABLE, BookStatus.RESERVED],
+            BookStatus.LOST,
+        )
+        if item_ids:
+            self.env["book.item.reservation"].search(
+                [
+                    ("book_item", "in", item_ids),
+                    ("status", "=", ReservationStatus.WAITING),
+                ]
+            ).write({"status": ReservationStatus.CANCELLED})
+
+        return True
+
+    def action_mark_found_available(self):
+        """Return every lost item found on the shelf to circulation."""
+        self._resolve_items(
+            StockTakeResult.FOUND, [BookStatus.LOST], BookStatus.AVAILABLE
+        )
+        return True
+
+    def action_close(self):
+        """Close the stock-take session."""
+        for record in self:
+            record.status = StockTakeStatus.DONE
+
+        return True
+
+
+class StockTakeScan(models.Model):
+    """A barcode scanned during a stock-take."""
+
+    _name = "stock.take.scan"
+    _description = "A barcode scanned during a stock-take."
+    _order = "id desc"
+
+    stock_take = fields.Many2one(
+        "stock.take", required=True, ondelete="cascade", index=True
+    )
+    barcode = fields.Char(required=True, readonly=True)
+    scanned_on = fields.Datetime(
+        default=lambda self: fields.Datetime.now(), readonly=True
+    )
+
+
+class StockTakeLine(models.Model):
+    """A discrepancy found while reconciling a stock-take."""
+
+    _name = "stock.take.line"
+    _description = "A discrepancy between the shelves and the book items."
+    _order = "result, barcode"
+
+    stock_take = fields.Many2one(
+        "stock.take", required=True, ondelete="cascade", index=True
+    )
+    book_item = fields.Many2one("book.item", ondelete="set null", readonly=True)
+    barcode = fields.Char(readonly=True)
+    result = fields.Selection(
+        selection=StockTakeResult.SELECTION, readonly=True
+    )
+    resolved = fields.Boolean(
+        readonly=True, help="Whether the book item status was updated."
+    )